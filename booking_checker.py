@@ -1,42 +1,140 @@
 import time
 import json
+import bisect
+import asyncio
 import nodriver as n
-from datetime import datetime
-from typing import Dict, Set
+from datetime import datetime, date
+from collections import namedtuple
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple
 
 # Local imports (assuming these exist in your project structure)
+from utils.common import evaluate_value
 from utils.logger import setup_logger
 
 log = setup_logger(__name__)
 
+_MONTHS = {
+    "Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6,
+    "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12
+}
+
+def _parse_portal_date(s):
+    """
+    Parses the portal's fixed 'DD/Mon/YYYY' date format without going through strptime.
+    Falls back to strptime for anything that doesn't fit the fixed layout.
+    """
+    try:
+        return date(int(s[7:11]), _MONTHS[s[3:6]], int(s[0:2]))
+    except (KeyError, ValueError):
+        return datetime.strptime(s, "%d/%b/%Y").date()
+
+class Booking(NamedTuple):
+    """A booked session parsed from the dashboard."""
+    date: date
+    session: int
+
+    @classmethod
+    def from_slot(cls, slot):
+        """Builds a Booking from a slot dict as returned by get_slot_statuses."""
+        return cls(_parse_portal_date(slot["date"]), slot["session"])
+
+class SortedBookings:
+    """
+    Bookings kept in (date, session) order. Iterate it directly instead of sorting per use;
+    add() inserts in place with bisect and bumps `version`, so caches can tell it changed.
+    """
+    __slots__ = ("_data", "_version")
+
+    def __init__(self, bookings=()):
+        self._data = sorted(bookings)
+        self._version = 0
+
+    @property
+    def version(self):
+        return self._version
+
+    def add(self, booking):
+        bisect.insort(self._data, booking)
+        self._version += 1
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+# Per-date tags used by filter_practical_slots
+_DATE_BOOKED = 1
+_DATE_INCLUDED = 2
+_DATE_EXCLUDED = 3
+
+# In-flight dashboard scrapes keyed by course_value
+_inflight: Dict[str, asyncio.Future] = {}
+
+DASHBOARD_URL = "https://bookingportal.cdc.com.sg/NewPortal/Booking/Dashboard.aspx"
+
+async def _find_loaded_dashboard(driver):
+    """
+    Returns an open tab that is already on the dashboard with the bookings table rendered, or None.
+    `driver` may be the browser (all its tabs are checked) or a single tab.
+    """
+    for t in getattr(driver, "tabs", None) or [driver]:
+        try:
+            if t.url and t.url.endswith("Dashboard.aspx") and await evaluate_value(
+                t, "!!document.getElementById('ctl00_ContentPlaceHolder1_gvBooked')"
+            ):
+                return t
+        except Exception:
+            continue
+    return None
+
 async def get_all_manual_bookings(driver, course_value, course_display_name):
     """
     Retrieves all current bookings from the dashboard using nodriver.
+    Concurrent calls for the same course share a single in-flight scrape.
     """
+    task = _inflight.get(course_value)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_manual_bookings(driver, course_value, course_display_name))
+        _inflight[course_value] = task
+        task.add_done_callback(lambda _: _inflight.pop(course_value, None))
+    else:
+        log.debug(f"Joining in-flight {course_display_name} bookings fetch.")
+
+    # Shielded so one caller being cancelled doesn't abort the fetch for the others
+    return await asyncio.shield(task)
+
+async def _fetch_manual_bookings(driver, course_value, course_display_name):
     log.debug(f"Retrieving all {course_display_name} bookings...")
     
     # ---------------------------------------------------------
     # 1. NAVIGATION & TAB RECOVERY
     # ---------------------------------------------------------
-    try:
-        tab = await driver.get("https://bookingportal.cdc.com.sg/NewPortal/Booking/Dashboard.aspx")
-        if not tab: raise Exception("Tab is None")
-    except:
-        log.warning("driver.get() returned None. Searching open tabs...")
-        tab = None
-        for t in driver.tabs:
-            if "Booking/Dashboard" in t.url:
-                tab = t
-                break
-        if not tab: 
-            tab = driver.main_tab
+    # Reuse a tab that already has the table rendered instead of reloading the dashboard
+    tab = await _find_loaded_dashboard(driver)
+    table_ready = tab is not None
+    if table_ready:
+        log.debug("Reusing open dashboard tab.")
+    else:
+        try:
+            tab = await driver.get(DASHBOARD_URL)
+            if not tab: raise Exception("Tab is None")
+        except:
+            log.warning("driver.get() returned None. Searching open tabs...")
+            tab = None
+            for t in driver.tabs:
+                if "Booking/Dashboard" in t.url:
+                    tab = t
+                    break
+            if not tab: 
+                tab = driver.main_tab
 
     # ---------------------------------------------------------
     # 2. LOGIN CHECK
     # ---------------------------------------------------------
     if "login" in tab.url.lower() or "signin" in tab.url.lower():
         log.critical("Redirected to Login Page! You are not logged in.")
-        return []
+        return SortedBookings()
 
     bookings = []
 
@@ -44,58 +142,58 @@ async def get_all_manual_bookings(driver, course_value, course_display_name):
         # ---------------------------------------------------------
         # 3. WAIT FOR TABLE
         # ---------------------------------------------------------
-        await tab.wait_for("#ctl00_ContentPlaceHolder1_gvBooked", timeout=15)
+        if not table_ready:
+            await tab.wait_for("#ctl00_ContentPlaceHolder1_gvBooked", timeout=15)
 
         # ---------------------------------------------------------
-        # 4. ROBUST EXTRACTION (JSON Strategy)
+        # 4. ROBUST EXTRACTION (structured values)
         # ---------------------------------------------------------
-        # We use the exact logic from test_extraction.py
-        extraction_js = """
-        (() => {
-            const rows = Array.from(document.querySelectorAll('#ctl00_ContentPlaceHolder1_gvBooked tr'));
+        # Course filtering and date/session conversion happen in the browser,
+        # so only matching [isoDate, session] pairs cross CDP.
+        extraction_js = f"""
+        (() => {{
+            const target = {json.dumps(course_value)};
+            const months = {{
+                Jan: '01', Feb: '02', Mar: '03', Apr: '04', May: '05', Jun: '06',
+                Jul: '07', Aug: '08', Sep: '09', Oct: '10', Nov: '11', Dec: '12'
+            }};
+            const rows = document.querySelectorAll('#ctl00_ContentPlaceHolder1_gvBooked tr');
+            const out = [];
             
-            const data = rows.map(row => {
-                 const cells = row.querySelectorAll('td');
-                 
-                 // Filter out headers (which use <th>) or malformed rows
-                 if (cells.length < 5) return null;
-                 
-                 // Return simple array: [Date, Session, Course]
-                 return [
-                     cells[0].innerText.trim(), 
-                     cells[1].innerText.trim(), 
-                     cells[4].innerText.trim()
-                 ];
-             }).filter(r => r !== null);
-
-            return JSON.stringify(data);
-        })();
+            // Single pass over the rows, no intermediate arrays
+            for (let i = 0; i < rows.length; i++) {{
+                const cells = rows[i].children;
+                
+                // Filter out headers (which use <th>) or malformed rows
+                if (cells.length < 5 || cells[0].tagName !== 'TD') continue;
+                if (cells[4].innerText.trim() !== target) continue;
+                
+                // 'DD/Mon/YYYY' -> 'YYYY-MM-DD', null if the cell doesn't parse
+                const parts = cells[0].innerText.trim().split('/');
+                const month = parts.length === 3 ? months[parts[1]] : undefined;
+                const session = parseInt(cells[1].innerText, 10);
+                
+                // [isoDate, session]
+                out.push([
+                    month ? `${{parts[2]}}-${{month}}-${{parts[0].padStart(2, '0')}}` : null,
+                    isNaN(session) ? null : session
+                ]);
+            }}
+            return out;
+        }})();
         """
         
-        # Get string data and parse it in Python
-        json_str = await tab.evaluate(extraction_js)
-        raw_rows = json.loads(json_str)
+        raw_rows = await evaluate_value(tab, extraction_js) or []
 
-        log.debug(f"Parsed {len(raw_rows)} rows from dashboard.")
-
-        for row in raw_rows:
-            # row is ['Date', 'Session', 'Course']
-            r_date, r_session, r_course = row[0], row[1], row[2]
-
-            # Filter by Course Name
-            if r_course != course_value:
-                continue
+        log.debug(f"Parsed {len(raw_rows)} {course_display_name} rows from dashboard.")
 
+        for iso, session_no in raw_rows:
             try:
-                date_obj = datetime.strptime(r_date, "%d/%b/%Y")
-                session_no = int(r_session)
-                
-                bookings.append({
-                    "date": date_obj,
-                    "session": session_no
-                })
+                if iso is None or session_no is None:
+                    raise ValueError("unparseable date or session")
+                bookings.append(Booking(date.fromisoformat(iso), session_no))
             except ValueError as ve:
-                log.error(f"Failed to parse row {row}: {ve}")
+                log.error(f"Failed to parse row {[iso, session_no]}: {ve}")
                 continue
 
         log.info(f"Retrieved {len(bookings)} {course_display_name} booking(s).")
@@ -107,7 +205,84 @@ async def get_all_manual_bookings(driver, course_value, course_display_name):
         except:
             pass
 
-    return bookings
+    return SortedBookings(bookings)
+
+_FilterConfig = namedtuple("_FilterConfig", ["one_slot_per_day", "non_peak_sessions", "allowed_by_wd", "config_index"])
+
+# config day keys -> date.weekday()
+_WEEKDAYS = {"MON": 0, "TUE": 1, "WED": 2, "THU": 3, "FRI": 4, "SAT": 5, "SUN": 6}
+
+# (config, prepared) for the last config seen; config is static across polling cycles
+_prepared_config = None
+
+def _prepare_config(config):
+    """
+    Builds the lookup structures filter_practical_slots needs from `config`,
+    reusing the previous result while the same config object is passed in.
+    """
+    global _prepared_config
+    if _prepared_config is not None and _prepared_config[0] is config:
+        return _prepared_config[1]
+
+    # Allowed sessions indexed by weekday int, empty for days not in config
+    allowed_by_wd: List[FrozenSet[int]] = [frozenset()] * 7
+    for day, sessions in config.get("allowed_sessions", {}).items():
+        wd = _WEEKDAYS.get(str(day)[:3].upper())
+        if wd is None:
+            log.warning(f"Ignoring unknown day '{day}' in allowed_sessions.")
+            continue
+        allowed_by_wd[wd] = frozenset(sessions)
+
+    # Later writes win, so included dates override exclusions
+    config_index: Dict[str, Tuple[int, Optional[FrozenSet[int]]]] = {}
+    for d in config.get("excluded_dates", []):
+        config_index[d] = (_DATE_EXCLUDED, None)
+    for d, sessions in config.get("included_dates", {}).items():
+        config_index[d] = (_DATE_INCLUDED, frozenset(sessions))
+
+    prepared = _FilterConfig(
+        one_slot_per_day=config.get("one_slot_per_day", False),
+        non_peak_sessions=frozenset(config.get("non_peak_sessions", {1, 3, 4})),
+        allowed_by_wd=allowed_by_wd,
+        config_index=config_index,
+    )
+    _prepared_config = (config, prepared)
+    return prepared
+
+# (config, bookings, len(bookings), date_index, booked_dates) for the last bookings seen.
+# Keyed on the SortedBookings object and its version; a new scrape is a new object and
+# every add() bumps the version. Other iterables are indexed afresh on each call.
+_booked_index = None
+
+def _index_bookings(config, config_index, existing_bookings):
+    """
+    Returns (date_index, booked_dates): the config's date index with booked dates overlaid,
+    and the frozenset of booked ISO dates. Rebuilt only when the config or bookings change.
+    """
+    global _booked_index
+    version = getattr(existing_bookings, "version", None)
+    cached = _booked_index
+    if (version is not None and cached is not None and cached[0] is config
+            and cached[1] is existing_bookings and cached[2] == version):
+        return cached[3], cached[4]
+
+    booked_slots: Dict[str, Set[int]] = {}
+    for b in existing_bookings:
+        booked_slots.setdefault(b.date.isoformat(), set()).add(b.session)
+
+    # One lookup per slot: date -> (tag, sessions). Booked beats included beats excluded.
+    date_index = dict(config_index)
+    for d, sessions in booked_slots.items():
+        date_index[d] = (_DATE_BOOKED, frozenset(sessions))
+
+    booked_dates = frozenset(booked_slots)
+    _booked_index = (config, existing_bookings, version, date_index, booked_dates)
+    return date_index, booked_dates
+
+# Slots rejected by config rules alone, keyed by (raw date, session), and the
+# (config, booked dates) they were computed under
+_rejected_keys: Set[Tuple[str, int]] = set()
+_rejected_keys_basis = None
 
 def filter_practical_slots(slots, config, existing_bookings, bot):
     """
@@ -117,77 +292,90 @@ def filter_practical_slots(slots, config, existing_bookings, bot):
     t_start = time.perf_counter()
 
     filtered = []
-    dates_with_a_found_slot = set()
+    dates_with_a_found_slot: Dict[str, None] = {}  # only tested and added to; dict has the faster str-key path
+    # Available slots repeat the same dates across sessions, so parse each raw date once
+    parse_cache: Dict[str, Tuple[str, date]] = {}
     
-    # Config extraction
-    one_slot_per_day: bool = config.get("one_slot_per_day", False)
-    excluded_dates: Set[str] = set(config.get("excluded_dates", []))
-    non_peak_sessions: Set[int] = set(config.get("non_peak_sessions", {1, 3, 4}))
-    
-    allowed_sessions: Dict[str, Set[int]] = {
-        day: set(sessions) for day, sessions in config.get("allowed_sessions", {}).items()
-    }
-    included_dates_sessions: Dict[str, Set[int]] = {
-        date: set(sessions) for date, sessions in config.get("included_dates", {}).items()
-    }
+    one_slot_per_day, non_peak_sessions, allowed_by_wd, config_index = _prepare_config(config)
+
+    date_index, booked_dates = _index_bookings(config, config_index, existing_bookings)
 
-    booked_slots: Dict[str, int] = {
-        b["date"].strftime("%Y-%m-%d"): b["session"] for b in existing_bookings
-    }
+    # Config-only rejections stay valid until the config or the set of booked dates changes
+    global _rejected_keys_basis
+    if _rejected_keys_basis is None or _rejected_keys_basis[0] is not config or _rejected_keys_basis[1] != booked_dates:
+        _rejected_keys.clear()
+        _rejected_keys_basis = (config, booked_dates)
+    rejected = _rejected_keys
+
+    date_index_get = date_index.get
+    non_peak_contains = non_peak_sessions.__contains__
 
     for slot in slots:
-        slot_date_obj = datetime.strptime(slot["date"], "%d/%b/%Y").date()
-        date_str = slot_date_obj.strftime("%Y-%m-%d")
-        weekday = slot["dayname"][:3].upper()
+        raw_date = slot["date"]
         session = slot["session"]
+        k = (raw_date, session)
+        if k in rejected:
+            continue
+
+        cached = parse_cache.get(raw_date)
+        if cached is None:
+            parsed = _parse_portal_date(raw_date)
+            cached = (parsed.isoformat(), parsed)
+            parse_cache[raw_date] = cached
+        date_str, slot_date_obj = cached
 
         # 1. One slot per day check
         if one_slot_per_day and date_str in dates_with_a_found_slot:
             continue
 
-        # 2. Check against existing bookings
-        if date_str in booked_slots:
-            booked_session = booked_slots[date_str]
-            # Upgrade logic: Earlier, non-peak session
-            if session < booked_session and session in non_peak_sessions:
-                msg = (
-                    f"Found an earlier non-peak slot on a booked date!\n"
-                    f"Date: {slot_date_obj.strftime('%d %b %Y, %a')}\n"
-                    f"New Slot: Session {session}\n"
-                    f"Current Slot: Session {booked_session}\n\n"
-                    f"Note: You must cancel your existing booking for this day before booking the new one."
-                )
-                log.debug(msg)
-                bot.send(msg)
-                filtered.append(slot)
-                dates_with_a_found_slot.add(date_str)
+        info = date_index_get(date_str)
+        if info is not None:
+            tag, tagged_sessions = info
+
+            # 2. Check against existing bookings
+            if tag == _DATE_BOOKED:
+                booked_session = min(tagged_sessions)
+                # Upgrade logic: Earlier, non-peak session
+                if session < booked_session and non_peak_contains(session):
+                    msg = (
+                        f"Found an earlier non-peak slot on a booked date!\n"
+                        f"Date: {slot_date_obj.strftime('%d %b %Y, %a')}\n"
+                        f"New Slot: Session {session}\n"
+                        f"Current Slot: Session {booked_session}\n\n"
+                        f"Note: You must cancel your existing booking for this day before booking the new one."
+                    )
+                    log.debug(msg)
+                    bot.send(msg)
+                    filtered.append(slot)
+                    dates_with_a_found_slot[date_str] = None
                 continue
-            continue
 
-        # 3. Included Dates (Overrides exclusions)
-        if date_str in included_dates_sessions:
-            if session in included_dates_sessions[date_str]:
-                log.debug(f"MATCH (Included): {date_str} S{session}")
-                filtered.append(slot)
-                dates_with_a_found_slot.add(date_str)
-            continue
+            # 3. Included Dates (Overrides exclusions)
+            if tag == _DATE_INCLUDED:
+                if session in tagged_sessions:
+                    log.debug("MATCH (Included): %s S%d", date_str, session)
+                    filtered.append(slot)
+                    dates_with_a_found_slot[date_str] = None
+                else:
+                    rejected.add(k)
+                continue
 
-        # 4. Excluded Dates
-        if date_str in excluded_dates:
+            # 4. Excluded Dates
+            rejected.add(k)
             continue
 
         # 5. Allowed Days/Sessions
-        allowed_sessions_for_day = allowed_sessions.get(weekday, set())
-        if not allowed_sessions_for_day or session not in allowed_sessions_for_day:
+        if session not in allowed_by_wd[slot_date_obj.weekday()]:
+            rejected.add(k)
             continue
 
         # Valid Match
-        log.debug(f"MATCH: {date_str} S{session}")
+        log.debug("MATCH: %s S%d", date_str, session)
         filtered.append(slot)
-        dates_with_a_found_slot.add(date_str)
+        dates_with_a_found_slot[date_str] = None
         
     t_end = time.perf_counter()
-    log.info(f"Filtered {len(slots)} slots down to {len(filtered)} in {(t_end - t_start) * 1000:.2f} ms.")
+    log.info("Filtered %d slots down to %d in %.2f ms.", len(slots), len(filtered), (t_end - t_start) * 1000)
 
     return filtered
 
@@ -203,9 +391,9 @@ async def is_slot_confirmed(driver, target_date, target_session, course_value):
         for b in bookings:
             # Convert booking date to string to match target_date format (assuming dd/Mon/YYYY)
             # You might need to adjust format depending on what 'target_date' string looks like
-            b_date_str = b["date"].strftime("%d/%b/%Y") 
+            b_date_str = b.date.strftime("%d/%b/%Y") 
             
-            if b_date_str == target_date and b["session"] == target_session:
+            if b_date_str == target_date and b.session == target_session:
                 return True
                 
         return False
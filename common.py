@@ -1,34 +1,85 @@
 import random
 import time
 import csv
+import json
 import asyncio
+from collections import deque
 from datetime import datetime
 from os.path import exists
+from nodriver import cdp
 from utils.logger import setup_logger
 
 log = setup_logger(__name__)
 
+# Recent (duration, success) outcomes of Cloudflare waits, used to slow polling when challenges stick
+_cf_recent = deque(maxlen=10)
+
+# Cloudflare wait rows are handed to a single background writer task
+_cf_log_queue = None
+_cf_log_writer_task = None
+
+# Base sleep ranges (seconds) per refresh mode
+_DELAY_RANGES = {
+    "aggressive": (2, 4),  # Increased from 3-5
+    "probe": (5, 9),  # Increased from 2-4
+    "normal": (13, 40),  # Increased from 15-24
+}
+_rand = random.Random().uniform
+
 # sleep function for random delay
-async def sleep_random(refresh_mode, backoff_multiplier=1.0):
+async def sleep_random(refresh_mode, backoff_multiplier=1.0, stop_event=None):
     """
     Sleep with random delays based on current mode.
     Applies backoff multiplier to slow down when hitting rate limits.
+    Returns early once `stop_event` is set, if one is given.
     """
     if refresh_mode.in_aggressive():
-        delay = random.uniform(2, 4)  # Increased from 3-5
-        log.debug(f"Aggressive mode: base sleep {delay:.2f}s")
+        mode = "aggressive"
     elif refresh_mode.in_probe():
-        delay = random.uniform(5, 9)  # Increased from 2-4
-        log.debug(f"Probe mode: base sleep {delay:.2f}s")
+        mode = "probe"
     else:
-        delay = random.uniform(13, 40)  # Increased from 15-24
-        log.debug(f"Normal mode: base sleep {delay:.2f}s")
+        mode = "normal"
+
+    delay = _rand(*_DELAY_RANGES[mode])
+    log.debug("%s mode: base sleep %.2fs", mode.capitalize(), delay)
     
     actual_delay = delay * backoff_multiplier
     if backoff_multiplier > 1.0:
         log.info(f"Applying {backoff_multiplier:.2f}x backoff: sleeping {actual_delay:.2f}s")
     
-    await asyncio.sleep(actual_delay)
+    if stop_event is None:
+        await asyncio.sleep(actual_delay)
+    else:
+        await wait_for_event(stop_event, actual_delay)
+
+async def wait_for_event(event, timeout):
+    """Waits up to `timeout` seconds for `event`; returns True if it was set."""
+    try:
+        await asyncio.wait_for(event.wait(), timeout=timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+def suggested_backoff():
+    """
+    Backoff multiplier for sleep_random based on recent Cloudflare waits:
+    1.0 when challenges clear on their own, up to 3.0 when they all time out.
+    """
+    if not _cf_recent:
+        return 1.0
+    fail_ratio = sum(1 for _, success in _cf_recent if not success) / len(_cf_recent)
+    return 1.0 + (fail_ratio * 2.0)
+
+_MAX_EMPTY_BACKOFF = 8.0
+
+def empty_cycle_backoff(refresh_mode, consecutive_empty):
+    """
+    Backoff multiplier for consecutive cycles that found no slots at all: doubles per cycle
+    up to 8x, with +/-20% jitter. Stays at 1.0 in aggressive or probe mode.
+    """
+    if consecutive_empty <= 0 or refresh_mode.in_aggressive() or refresh_mode.in_probe():
+        return 1.0
+    return min(_MAX_EMPTY_BACKOFF, 2.0 ** min(consecutive_empty, 3) * _rand(0.8, 1.2))
 
 async def cloudflare_handler(tab, bot):
     log.debug("Checking for Cloudflare challenge page...")
@@ -38,14 +89,18 @@ async def cloudflare_handler(tab, bot):
             log.info("Verified Cloudflare challenge. Continuing...")
         
 
+# Cloudflare's challenge markup, plus the interstitial title as a fallback for pages without it.
+# #cf-wrapper is left out on purpose: Cloudflare's error pages (5xx, 1020) use it too.
+_CF_CHALLENGE_JS = (
+    "!!document.querySelector('#challenge-running, .cf-browser-verification')"
+    " || document.title.toLowerCase().includes('just a moment')"
+)
+
 # cloudflare detection function  
 async def is_cloudflare_challenge_page(tab, bot):
     try:
-        # nodriver: evaluate document.title
-        title = await tab.evaluate("document.title")
-        if title and "just a moment" in title.lower():
-            return True
-        return False
+        # Match in the browser so only a boolean crosses CDP
+        return bool(await evaluate_value(tab, _CF_CHALLENGE_JS))
     
     except Exception as e:
         log.error(f"Error detecting Cloudflare challenge page: {e}")
@@ -61,42 +116,128 @@ async def wait_for_cloudflare_challenge_to_clear(tab, timeout=15, log_path="logs
     start_time = time.time()
     log.info(f"Waiting up to {timeout}s for Cloudflare challenge to clear...")
 
+    # Poll quickly at first so fast clears return early, then back off to spare CDP
+    delay = 0.1
     while time.time() - start_time < timeout:
         if not await is_cloudflare_challenge_page(tab, bot=None):
             duration = round(time.time() - start_time, 2)
             log.info(f"Cloudflare challenge cleared after {duration:.2f}s.")
+            _cf_recent.append((duration, True))
             log_cloudflare_wait_csv(duration, success=True, log_path=log_path)
             return True
-        await asyncio.sleep(0.5)
+        await asyncio.sleep(delay)
+        delay = min(delay * 1.5, 1.0)
 
     duration = round(time.time() - start_time, 2)
     log.error(f"Cloudflare challenge did NOT clear after {duration:.2f}s.")
+    _cf_recent.append((duration, False))
     log_cloudflare_wait_csv(duration, success=False, log_path=log_path)
     return False
 
 def log_cloudflare_wait_csv(duration, success, log_path):
     """
-    Logs Cloudflare wait data in CSV format:
+    Queues Cloudflare wait data for the background CSV writer:
     timestamp, outcome, duration
     """
+    global _cf_log_queue, _cf_log_writer_task
+
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     outcome = "CLEARED" if success else "TIMEOUT"
-    header = ["timestamp", "outcome", "duration_s"]
-
-    # Write header if file doesn't exist
-    write_header = not exists(log_path)
-    with open(log_path, "a", newline="") as f:
-        writer = csv.writer(f)
-        if write_header:
-            writer.writerow(header)
-        writer.writerow([timestamp, outcome, duration])
-        log.debug(f"Logged Cloudflare wait: {timestamp}, {outcome}, {duration}s to {log_path}")
+
+    if _cf_log_queue is None:
+        _cf_log_queue = asyncio.Queue()
+    if _cf_log_writer_task is None or _cf_log_writer_task.done():
+        _cf_log_writer_task = asyncio.create_task(_cf_log_writer())
+
+    _cf_log_queue.put_nowait((log_path, [timestamp, outcome, duration]))
+
+async def _cf_log_writer():
+    """
+    Drains the Cloudflare wait queue in batches. Each log file is opened once,
+    and the writes run in a worker thread so the event loop never blocks on disk.
+    """
+    files = {}
+    write = None
+    try:
+        while True:
+            batch = [await _cf_log_queue.get()]
+            while not _cf_log_queue.empty():
+                batch.append(_cf_log_queue.get_nowait())
+            # A plain executor future (not a Task) so shutdown can't cancel a half-written batch
+            write = asyncio.get_running_loop().run_in_executor(None, _write_cf_rows, files, batch)
+            await asyncio.shield(write)
+    finally:
+        # Let an in-flight batch finish, flush whatever is still queued, then release the files
+        if write is not None and not write.done():
+            await write
+        pending = []
+        while not _cf_log_queue.empty():
+            pending.append(_cf_log_queue.get_nowait())
+        if pending:
+            _write_cf_rows(files, pending)
+        for f in files.values():
+            f.close()
+
+def _write_cf_rows(files, batch):
+    for log_path, row in batch:
+        f = files.get(log_path)
+        if f is None:
+            # Header check happens once, when the file is first opened
+            write_header = not exists(log_path)
+            f = files[log_path] = open(log_path, "a", newline="")
+            if write_header:
+                csv.writer(f).writerow(["timestamp", "outcome", "duration_s"])
+        csv.writer(f).writerow(row)
+        log.debug(f"Logged Cloudflare wait: {row[0]}, {row[1]}, {row[2]}s to {log_path}")
+    for f in files.values():
+        f.flush()
     
+async def evaluate_value(tab, expression, await_promise=False):
+    """
+    Evaluates `expression` with returnByValue so arrays/objects come back as plain Python data.
+    nodriver hands back the raw RemoteObject for falsy results (false, 0, "", []) and the
+    ExceptionDetails for script errors, so both are unwrapped here.
+    """
+    result = await tab.evaluate(expression, await_promise=await_promise, return_by_value=True)
+    if isinstance(result, cdp.runtime.ExceptionDetails):
+        raise Exception(f"JS evaluation failed: {result.text}")
+    if isinstance(result, cdp.runtime.RemoteObject):
+        return result.value
+    return result
+
+# Resolves with location.href once it contains `fragment`, or with the last URL after `timeoutMs`;
+# the interval runs in the page
+_WAIT_FOR_URL_JS = """
+(fragment, timeoutMs) => new Promise(r => {
+    const ok = () => location.href.includes(fragment);
+    if (ok()) return r(location.href);
+    const i = setInterval(() => { if (ok()) { clearInterval(i); r(location.href); } }, 50);
+    setTimeout(() => { clearInterval(i); r(location.href); }, timeoutMs);
+})
+"""
+
+async def wait_for_url(tab, fragment, timeout=10.0):
+    """
+    Waits in the page until the URL contains `fragment` and returns it, or the last URL seen
+    (None if none could be read) after `timeout`. A navigation replaces the page context, which
+    rejects the pending call, so it is re-issued with the time left and resolves at once on arrival.
+    """
+    end_time = time.perf_counter() + timeout
+    current_url = None
+    while True:
+        remaining_ms = int((end_time - time.perf_counter()) * 1000)
+        if remaining_ms <= 0:
+            return current_url
+        try:
+            expression = f"({_WAIT_FOR_URL_JS})({json.dumps(fragment)}, {remaining_ms})"
+            current_url = await evaluate_value(tab, expression, await_promise=True)
+            return current_url
+        except Exception as e:
+            log.debug("URL wait interrupted: %s", e)
+            await asyncio.sleep(0.1)  # give the new document a moment to get a context
+
 async def wait_for_elem(tab, value, timeout=10.0):
-    try:
-        return await tab.wait_for(selector=f"#{value}", timeout=timeout)
-    except Exception as e:
-        raise
+    return await tab.wait_for(selector=f"#{value}", timeout=timeout)
 
 async def anonymize_fields(tab):
     anon_map = {
@@ -110,9 +251,12 @@ async def anonymize_fields(tab):
 
     log.debug(f"Anonymizing fields in the booking portal called at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
-    for elem_id, fake_text in anon_map.items():
-        script = f"document.getElementById('{elem_id}').innerText = '{fake_text}';"
-        try:
-            await tab.evaluate(script)
-        except Exception:
-            pass # Element might not exist
\ No newline at end of file
+    # One round-trip for all fields; missing elements are skipped in the browser
+    script = (
+        f"((m) => {{ for (const [k, v] of Object.entries(m)) {{"
+        f" const e = document.getElementById(k); if (e) e.innerText = v; }} }})({json.dumps(anon_map)});"
+    )
+    try:
+        await tab.evaluate(script)
+    except Exception:
+        pass # Page might not be scriptable right now
\ No newline at end of file
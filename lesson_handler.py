@@ -1,12 +1,205 @@
 import asyncio
+import base64
 import time
 import json
+from nodriver import cdp
 from utils import logger
-from utils.common import cloudflare_handler
+from utils.common import cloudflare_handler, evaluate_value, wait_for_url
 from utils.logger import setup_logger
 
 log = setup_logger(__name__)
 
+# Strong references to fire-and-forget tasks so they aren't garbage-collected mid-flight
+_background_tasks = set()
+
+# Page scripts are kept as constant function sources and called with json.dumps'd arguments,
+# so the source text is identical on every call and V8 can reuse its compiled code.
+
+# (courseValue) -> Promise<{ok, reason}>: waits for the course dropdown to be ready, selects the course, fires change
+_SELECT_COURSE_JS = """
+(V) => new Promise(resolve => {
+    const tryDo = () => {
+        const el = document.getElementById('ctl00_ContentPlaceHolder1_ddlCourse');
+        if (!el) return false;
+        if (el.offsetParent === null || el.disabled) return false;  // Hidden or disabled
+
+        // Verify value exists in options
+        if (!Array.from(el.options).some(opt => opt.value === V)) {
+            resolve({ ok: false, reason: 'no_option' });
+            return true;
+        }
+
+        el.value = V;
+        el.dispatchEvent(new Event('change', { bubbles: true }));
+        resolve({ ok: true });
+        return true;
+    };
+    if (tryDo()) return;
+
+    const obs = new MutationObserver(() => {
+        if (tryDo()) {
+            obs.disconnect();
+            clearTimeout(timer);
+        }
+    });
+    obs.observe(document.documentElement, { childList: true, subtree: true, attributes: true });
+    const timer = setTimeout(() => {
+        obs.disconnect();
+        const el = document.getElementById('ctl00_ContentPlaceHolder1_ddlCourse');
+        resolve({ ok: false, reason: el ? 'not_ready' : 'missing' });
+    }, 5000);
+})
+"""
+
+# (timeoutMs) -> Promise<'full_msg' | 'table' | 'timeout'>: resolves when either result element becomes visible
+_WAIT_BOOKING_JS = """
+(timeoutMs) => new Promise(resolve => {
+    const check = () => {
+        // Check for full booking message (priority 1)
+        const msg = document.getElementById('ctl00_ContentPlaceHolder1_lblFullBookMsg');
+        if (msg && msg.style.display !== 'none' && msg.offsetParent !== null) {
+            resolve('full_msg');
+            return true;
+        }
+
+        // Check for slot table (priority 2)
+        const table = document.getElementById('ctl00_ContentPlaceHolder1_gvLatestav');
+        if (table && table.style.display !== 'none' && table.offsetParent !== null) {
+            resolve('table');
+            return true;
+        }
+
+        // Still waiting (spinner may or may not be visible)
+        return false;
+    };
+    if (check()) return;
+
+    const obs = new MutationObserver(() => {
+        if (check()) {
+            obs.disconnect();
+            clearTimeout(timer);
+        }
+    });
+    obs.observe(document.documentElement, {
+        subtree: true, childList: true, attributes: true, attributeFilter: ['style', 'class']
+    });
+    const timer = setTimeout(() => { obs.disconnect(); resolve('timeout'); }, timeoutMs);
+})
+"""
+
+# () -> [{date, dayname, session, element_id}] for available slots only.
+# The "available" filter runs in the page, so only bookable slots cross CDP.
+# Slot images: images0 unavailable, images1 available, images2 reserved, images3 booked.
+_EXTRACT_SLOTS_JS = """
+() => {
+    var rows = Array.from(document.querySelectorAll('#ctl00_ContentPlaceHolder1_gvLatestav tr')).slice(1);
+    var results = [];
+    rows.forEach(row => {
+        var tds = row.querySelectorAll('td');
+        if (tds.length < 2) return;
+
+        // textContent avoids forcing a layout per cell
+        var date = tds[0].textContent.trim();
+        var dayname = tds[1].textContent.trim();
+        var inputs = row.querySelectorAll('input[src]');
+
+        inputs.forEach((input, index) => {
+            var src = input.getAttribute('src');
+            if (src && src.toLowerCase().endsWith('images1.gif')) {
+                results.push({
+                    date: date,
+                    dayname: dayname,
+                    session: index + 1,
+                    element_id: input.id
+                });
+            }
+        });
+    });
+    return results;
+}
+"""
+
+# Overrides alert once per page load to capture its text without blocking.
+# window.__alertP resolves with the next alert's text and is re-armed after each one.
+_ALERT_HOOK_JS = """
+(() => {
+    if (window.__alertHooked) return;
+    window.__alertHooked = true;
+    window.lastAlert = null;
+    const arm = () => { window.__alertP = new Promise(r => { window.__alertR = r; }); };
+    arm();
+    window.alert = function(msg) { window.lastAlert = msg; const r = window.__alertR; arm(); r(msg); return true; };
+})()
+"""
+
+# (elementId) -> Promise<{k: 'alert' | 'success' | 'no_change' | 'error', v}>: clicks a slot and waits for the outcome.
+# The UpdatePanel may swap the image node, so it is re-queried on every mutation.
+_RESERVE_SLOT_JS = """
+(ID) => new Promise(resolve => {
+    const btn = document.getElementById(ID);
+    if (!btn) return resolve({ k: 'error', v: 'element not found' });
+
+    // No-op when the hook is already in place for this page
+    __ALERT_HOOK__;
+    window.lastAlert = null;
+    const alertP = window.__alertP;
+
+    // The postback's end is seen through ASP.NET AJAX's endRequest, or the spinner hiding again
+    const prm = (window.Sys && Sys.WebForms && Sys.WebForms.PageRequestManager)
+        ? Sys.WebForms.PageRequestManager.getInstance() : null;
+    let spinnerSeen = false;
+    let settle = null;
+
+    let done = false;
+    const finish = (result) => {
+        if (done) return;
+        done = true;
+        obs.disconnect();
+        clearTimeout(timer);
+        clearTimeout(settle);
+        if (prm) prm.remove_endRequest(onPostbackEnd);
+        resolve(result);
+    };
+    const noChange = () => {
+        const img = document.getElementById(ID);
+        finish({ k: 'no_change', v: img ? img.getAttribute('src') : null });
+    };
+    // The panel is re-rendered by now; give the image a moment before calling it unchanged
+    const onPostbackEnd = () => {
+        if (done || settle) return;
+        settle = setTimeout(() => { check(); noChange(); }, 1000);
+    };
+    const check = () => {
+        const img = document.getElementById(ID);
+        const src = img ? (img.getAttribute('src') || '') : '';
+        if (src.toLowerCase().includes('images2.gif')) return finish({ k: 'success' });
+
+        const spinner = document.getElementById('ctl00_ContentPlaceHolder1_UpdateProgress1');
+        if (spinner && spinner.style.display !== 'none') spinnerSeen = true;
+        else if (spinnerSeen) onPostbackEnd();
+    };
+
+    const obs = new MutationObserver(check);
+    obs.observe(document.documentElement, {
+        subtree: true, childList: true, attributes: true, attributeFilter: ['src', 'style']
+    });
+    // Upper bound only; a failed reservation normally ends with the postback
+    const timer = setTimeout(noChange, 12000);
+    if (prm) prm.add_endRequest(onPostbackEnd);
+
+    // Alerts don't mutate the DOM, so race the alert promise against the observer
+    alertP.then(msg => finish({ k: 'alert', v: msg }));
+
+    // The postback starts synchronously inside click(), after the observer is attached
+    btn.click();
+    check();
+})
+""".replace("__ALERT_HOOK__", _ALERT_HOOK_JS.strip())
+
+def _call_js(fn_source, *args):
+    """Builds an expression that calls a constant page-script function with JSON-encoded arguments."""
+    return f"({fn_source})({', '.join(json.dumps(a) for a in args)})"
+
 class LessonHandler:
     def __init__(self, tab, course_value, course_display_name, course2_value, bot):
         self.tab = tab
@@ -15,14 +208,64 @@ class LessonHandler:
         self.course_display_name = course_display_name
         self.bot = bot
         self.last_viewstate = None
+        self._alert_hook_installed = False
+
+    def _bg_screenshot(self, path):
+        """Captures a debug screenshot in the background so the recovery path doesn't wait on it."""
+        async def capture():
+            try:
+                await self.tab.save_screenshot(path)
+            except Exception:
+                pass
+
+        task = asyncio.create_task(capture())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    async def _snapshot_screenshot(self, path):
+        """
+        Captures the page as it is right now, then decodes and writes `path` in the background.
+        Unlike save_screenshot there is no settle delay, so it is safe to navigate straight after.
+        """
+        try:
+            data = await self.tab.send(cdp.page.capture_screenshot(format_="png"))
+        except Exception:
+            return
+
+        def write():
+            with open(path, "wb") as f:
+                f.write(base64.b64decode(data))
+
+        async def save():
+            try:
+                await asyncio.to_thread(write)
+            except Exception:
+                pass
+
+        task = asyncio.create_task(save())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    async def _install_alert_hook(self):
+        """Installs the alert override unless this page load already has it."""
+        if self._alert_hook_installed:
+            return
+        await self.tab.evaluate(_ALERT_HOOK_JS)
+        self._alert_hook_installed = True
 
     async def open_practical_booking_page(self):
         log.debug("Opening practical booking page...")
+        self._alert_hook_installed = False
         # Navigate using the tab object directly
         await self.tab.get("https://bookingportal.cdc.com.sg/NewPortal/Booking/BookingPL.aspx")
         # await self.tab.get("https://bookingportal.cdc.com.sg/NewPortal/Booking/BookingPT.aspx")
         # await self.tab.get("https://bookingportal.cdc.com.sg/NewPortal/Booking/BookingETrial.aspx")
 
+    async def reload(self):
+        """Reloads the current page; the fresh document needs the alert hook again."""
+        self._alert_hook_installed = False
+        await self.tab.reload()
+
     async def open_logout(self):
         log.debug("Opening logout page...")
         await self.tab.get("https://bookingportal.cdc.com.sg/NewPortal/logOut.aspx?PageName=Logout")
@@ -43,306 +286,165 @@ class LessonHandler:
                     # Strategy: Check if element exists BEFORE trying to query it
                     # This prevents the "Could not find node" error
                     
-                    # Step 1: Wait for element to exist in DOM
-                    exists_check = """
-                    (() => {
-                        const el = document.getElementById('ctl00_ContentPlaceHolder1_ddlCourse');
-                        return el !== null;
-                    })();
-                    """
-                    
-                    # Poll for element existence (faster than wait_for on reload)
-                    element_found = False
-                    for i in range(20):  # 20 * 0.25s = 5 second max wait
-                        try:
-                            exists = await self.tab.evaluate(exists_check)
-                            if exists:
-                                element_found = True
-                                break
-                        except Exception:
-                            pass  # Element doesn't exist yet, keep trying
-                        await asyncio.sleep(0.25)
+                    # One round-trip: wait in the page for the dropdown to exist and be interactive,
+                    # then select the course and fire change. Resolves immediately if it already is
+                    # ready, otherwise on the mutation that makes it so.
+                    result = await evaluate_value(
+                        self.tab, _call_js(_SELECT_COURSE_JS, self.course_value), await_promise=True
+                    ) or {}
                     
-                    if not element_found:
+                    if result.get("reason") == "missing":
                         raise Exception("Dropdown element not found in DOM after 5s")
                     
-                    # Step 2: Verify it's visible and interactive
-                    visibility_check = """
-                    (() => {
-                        const el = document.getElementById('ctl00_ContentPlaceHolder1_ddlCourse');
-                        if (!el) return false;
-                        if (el.offsetParent === null) return false;  // Hidden
-                        if (el.disabled) return false;  // Disabled
-                        return true;
-                    })();
-                    """
-                    
-                    is_ready = await self.tab.evaluate(visibility_check)
-                    if not is_ready:
+                    if result.get("reason") == "not_ready":
                         raise Exception("Dropdown exists but is not visible/interactive")
-                    
-                    # Small buffer to ensure it's fully interactive
-                    await asyncio.sleep(0.2)
                         
                 except Exception as e:
                     log.warning(f"Attempt {attempt}/{max_retries}: Course dropdown issue: {e}")
                     if attempt < max_retries:
                         log.info(f"Refreshing page and retrying...")
-                        await self.tab.reload()
+                        await self.reload()
                         
-                        # Wait for page to settle after reload
-                        await asyncio.sleep(2.0)
+                        # Let the reload commit before inspecting the new document;
+                        # the selection script itself waits for the dropdown to be ready
+                        await asyncio.sleep(0.5)
                         
                         # Check for Cloudflare
                         await cloudflare_handler(self.tab, self.bot)
                         
-                        # Additional buffer after CF check
-                        await asyncio.sleep(0.5)
-                        
                         continue 
                     else:
                         raise Exception(f"Failed to select course: {e}")
                 
-                # Step 3: Select the course (element is guaranteed to exist now)
-                js_script = f"""
-                (() => {{
-                    const select = document.getElementById('ctl00_ContentPlaceHolder1_ddlCourse');
-                    if (!select) return false;
-                    
-                    // Verify value exists in options
-                    const optionExists = Array.from(select.options).some(opt => opt.value === '{self.course_value}');
-                    if (!optionExists) {{
-                        console.error('Course value not found in dropdown options');
-                        return false;
-                    }}
-                    
-                    select.value = '{self.course_value}';
-                    
-                    // Trigger change event
-                    const event = new Event('change', {{ bubbles: true }});
-                    select.dispatchEvent(event);
-                    
-                    return true;
-                }})();
-                """
-
-                success = await self.tab.evaluate(js_script)
-                
-                if success:
+                if result.get("ok"):
                     if attempt == 1:
                         log.debug(f"Selected {self.course_display_name} course.")
                     else:
                         log.info(f"Selected {self.course_display_name} course on attempt {attempt}.")
                     return
                 else:
-                    raise Exception("JS Selection script returned false")
+                    raise Exception(f"JS Selection script returned false ({result.get('reason')})")
             
             except Exception as e:
                 if attempt == max_retries:
-                    try:
-                        await self.tab.save_screenshot("logs/error_select_course.png")
-                    except: 
-                        pass
+                    self._bg_screenshot("logs/error_select_course.png")
                     log.error(f"Failed to select course: {e}")
                     raise Exception(f"Failed to select course: {e}")
                 else:
-                    # Brief pause before retry
-                    await asyncio.sleep(0.5)
+                    # Short pause so a navigating page isn't hit again straight away; the next attempt waits in-page for the dropdown
+                    await asyncio.sleep(0.1)
 
-    async def wait_for_full_booking_msg_or_table(self, timeout=6.5, poll_interval=0.05):
+    async def wait_for_full_booking_msg_or_table(self, timeout=6.5):
         """
         Waits for either:
         - Full booking message (return True)
         - Slot table (return False)
         
+        The wait runs inside the page: a MutationObserver resolves as soon as either
+        element becomes visible, so this costs one CDP round-trip instead of a poll loop.
         Ignores progress spinner - just waits for final result.
         """
         t_start = time.perf_counter()
         end_time = t_start + timeout
-        
-        check_script = """
-        (() => {
-            // Check for full booking message (priority 1)
-            var msg = document.getElementById('ctl00_ContentPlaceHolder1_lblFullBookMsg');
-            if (msg && msg.style.display !== 'none' && msg.offsetParent !== null) {
-                return 'full_msg';
-            }
-            
-            // Check for slot table (priority 2)
-            var table = document.getElementById('ctl00_ContentPlaceHolder1_gvLatestav');
-            if (table && table.style.display !== 'none' && table.offsetParent !== null) {
-                return 'table';
-            }
-            
-            // Still waiting (spinner may or may not be visible)
-            return 'waiting';
-        })();
-        """
 
-        while time.perf_counter() < end_time:
+        while True:
+            remaining_ms = int((end_time - time.perf_counter()) * 1000)
+            if remaining_ms <= 0:
+                break
+
             try:
-                status = await self.tab.evaluate(check_script)
-                
-                if status == 'full_msg':
-                    elapsed = (time.perf_counter() - t_start) * 1000
-                    log.debug(f"Full booking message displayed. {elapsed:.2f}ms")
-                    return True
-                
-                elif status == 'table':
-                    elapsed = (time.perf_counter() - t_start) * 1000
-                    log.debug(f"Slot table displayed. {elapsed:.2f}ms")
-                    return False
-                
-                # Still waiting - continue polling (ignore spinner state)
-                
+                status = await evaluate_value(self.tab, _call_js(_WAIT_BOOKING_JS, remaining_ms), await_promise=True)
             except Exception as e:
-                log.debug(f"Poll error: {e}")
-                pass
+                # Page context can be replaced mid-wait (e.g. navigation); retry with the time left
+                log.debug("Wait script error: %s", e)
+                await asyncio.sleep(0.1)  # give the new document a moment to get a context
+                continue
+
+            if status == 'full_msg':
+                log.debug("Full booking message displayed. %.2fms", (time.perf_counter() - t_start) * 1000)
+                return True
+            
+            elif status == 'table':
+                log.debug("Slot table displayed. %.2fms", (time.perf_counter() - t_start) * 1000)
+                return False
 
-            await asyncio.sleep(poll_interval)
+            break
 
         # Timeout reached - server didn't respond in 25 seconds
         elapsed = (time.perf_counter() - t_start) * 1000
         log.error(f"⚠️ Timeout after {elapsed:.0f}ms - server not responding!")
         
-        # Take screenshot for debugging
-        try:
-            await self.tab.save_screenshot("logs/timeout_spinner.png")
-        except:
-            pass
+        # Capture the stuck page before reloading; only the file write runs in the background
+        await self._snapshot_screenshot("logs/timeout_spinner.png")
         
         # Reload and retry
         log.warning("Reloading page after timeout...")
-        await self.tab.reload()
-        await asyncio.sleep(1.5)
+        await self.reload()
+        await asyncio.sleep(0.5)  # let the reload commit; select_course waits for the dropdown itself
         await cloudflare_handler(self.tab, self.bot)
-        await asyncio.sleep(0.5)
         await self.select_course()
         
         # Try one more time after reload
-        return await self.wait_for_full_booking_msg_or_table(timeout=15, poll_interval=0.05)
+        return await self.wait_for_full_booking_msg_or_table(timeout=15)
 
     async def get_slot_statuses(self):
         """
         Returns a list of slot dictionaries using robust JSON extraction.
         """
-        log.debug(f"Getting slot statuses...")
+        log.debug("Getting slot statuses...")
         slot_data = []
 
-        status_map = {
-            "images0.gif": "unavailable",
-            "images1.gif": "available",
-            "images2.gif": "reserved",
-            "images3.gif": "booked"
-        }
-
         if await self.wait_for_full_booking_msg_or_table():
             return []
         
         t_pass_full_msg = time.perf_counter()
 
         try:
-            # FIX: Use JSON.stringify to ensure we get pure data back
-            js_extract = """
-            (() => {
-                var rows = Array.from(document.querySelectorAll('#ctl00_ContentPlaceHolder1_gvLatestav tr')).slice(1);
-                var results = [];
-                rows.forEach(row => {
-                    var tds = row.querySelectorAll('td');
-                    if (tds.length < 2) return;
-                    
-                    var date = tds[0].innerText.trim();
-                    var dayname = tds[1].innerText.trim();
-                    var inputs = row.querySelectorAll('input[src]');
-                    
-                    inputs.forEach((input, index) => {
-                        var src = input.getAttribute('src');
-                        if (src) {
-                            var img_src = src.split('/').pop().toLowerCase();
-                            results.push({
-                                date: date,
-                                dayname: dayname,
-                                session: index + 1,
-                                img_src: img_src,
-                                element_id: input.id
-                            });
-                        }
-                    });
-                });
-                return JSON.stringify(results);
-            })();
-            """
-            
-            # 1. Get string
-            json_str = await self.tab.evaluate(js_extract)
-            # 2. Parse string
-            raw_slots = json.loads(json_str)
-            
-            for slot in raw_slots:
-                status = status_map.get(slot['img_src'], "unknown")
-                # log.debug(f"Slot: {slot['date']} S{slot['session']} = {status}")
-
-                if status == "available":
-                    slot_data.append({
-                        "date": slot['date'],
-                        "dayname": slot['dayname'],
-                        "session": slot['session'],
-                        "status": status,
-                        "element_id": slot['element_id']
-                    })
+            js_extract = _call_js(_EXTRACT_SLOTS_JS)
+            try:
+                # CDP returns the array by value, no JSON round-trip needed
+                slot_data = await evaluate_value(self.tab, js_extract) or []
+            except Exception as e:
+                # Fall back to a string round-trip if the array can't be serialized by value
+                log.debug("By-value slot extraction failed, falling back to JSON: %s", e)
+                slot_data = json.loads(await self.tab.evaluate(f"JSON.stringify({js_extract})"))
 
         except Exception as e:
-            try:
-                await self.tab.save_screenshot("logs/error_slots.png")
-            except: pass
+            self._bg_screenshot("logs/error_slots.png")
             log.error(f"Error parsing slots: {e}")
 
         log.info(f"Found {len(slot_data)} available slots.")
         return slot_data
         
     async def reserve_slot(self, element_id):
+        """
+        Clicks the slot `element_id` and reports the outcome. The node is looked up by id inside
+        the same page script that clicks it, so there is no separate DOM query round-trip; ids are
+        also used instead of cached node handles because each UpdatePanel refresh replaces the nodes.
+        """
         try:
             t_start = time.perf_counter()
             
-            # Select element
-            input_elem = await self.tab.select(f"#{element_id}")
+            # One round-trip: hook alerts (if this page isn't hooked yet), click the slot and wait
+            # in the page for the outcome (an alert, the image flipping to reserved, or timeout)
+            outcome = await evaluate_value(self.tab, _call_js(_RESERVE_SLOT_JS, element_id), await_promise=True) or {}
+            self._alert_hook_installed = outcome.get("k") != "error"  # only a missing button skips the hook
+            log.debug("Clicked booking button: %s", element_id)
+
+            if outcome.get("k") == "error":
+                log.error(f"Error clicking element {element_id}: {outcome.get('v')}")
+                return "error", ""
             
-            # Override alert to capture text (Prevent blocking)
-            await self.tab.evaluate("window.lastAlert = null; window.alert = function(msg) { window.lastAlert = msg; return true; }")
-            
-            await input_elem.click()
-            log.debug(f"Clicked booking button: {element_id}")
-
-            # Check for alert
-            await asyncio.sleep(0.5)
-            alert_text = await self.tab.evaluate("window.lastAlert")
-            if alert_text:
+            if outcome.get("k") == "alert":
+                alert_text = outcome.get("v")
                 log.warning(f"Alert detected: {alert_text}")
                 return "alert", alert_text
 
-            # Wait for spinner to disappear
-            try:
-                for _ in range(20):
-                    visible = await self.tab.evaluate("document.getElementById('ctl00_ContentPlaceHolder1_UpdateProgress1').style.display !== 'none'")
-                    if not visible: break
-                    await asyncio.sleep(0.5)
-            except: pass
-        
-            # Wait for image change
-            new_src = None
-            try:
-                for _ in range(5): 
-                    new_src = await self.tab.evaluate(f"document.getElementById('{element_id}').getAttribute('src')")
-                    if new_src and "Images2.gif" in new_src:
-                        break
-                    await asyncio.sleep(0.5)
-            except: pass
-
-            if new_src and "Images2.gif" in new_src:
+            if outcome.get("k") == "success":
                 log.info(f"Successfully booked: {element_id}")
                 return "success", ""
             else:
-                log.info(f"Unsuccessful booking. Src remains: {new_src}")
+                log.info(f"Unsuccessful booking. Src remains: {outcome.get('v')}")
                 return "no_change", ""
 
         except Exception as e:
@@ -354,32 +456,30 @@ class LessonHandler:
             # 1. Click CHECKOUT
             checkout_btn = await self.tab.wait_for("#ctl00_ContentPlaceHolder1_btnCheckout", timeout=10)
             
-            # Alert override
-            await self.tab.evaluate("window.lastAlert = null; window.alert = function(msg) { window.lastAlert = msg; return true; }")
+            # Alert override; already in place when reserve_slot ran on this page
+            await self._install_alert_hook()
             
             await checkout_btn.click()
+            self._alert_hook_installed = False  # checkout navigates to a new page
             log.info("Clicked checkout.")
             
-            await asyncio.sleep(1) # Wait for page load
-            
             # 2. Click CONFIRM
-            # Need to wait for next page or button appearance
+            # wait_for returns as soon as the next page's button appears, no fixed page-load sleep needed
             try:
                 confirm_btn = await self.tab.wait_for("#ctl00_ContentPlaceHolder1_btnConfirm", timeout=10)
             except:
                 log.error("Confirm button did not appear.")
                 return False
 
-            await self.tab.evaluate("window.lastAlert = null; window.alert = function(msg) { window.lastAlert = msg; return true; }")
+            await self._install_alert_hook()
             
             await confirm_btn.click()
+            self._alert_hook_installed = False  # confirm navigates to the report page
             log.info("Clicked confirm.")
             
-            await asyncio.sleep(2) # Wait for final processing
-
-            # Check final URL
-            current_url = await self.tab.evaluate("window.location.href")
-            if "ReportPrView.aspx" in current_url:
+            # Check final URL, returning as soon as the report page loads
+            current_url = await wait_for_url(self.tab, "ReportPrView.aspx", timeout=10)
+            if current_url and "ReportPrView.aspx" in current_url:
                 log.info("Booking confirmed successfully!")
                 return True
             else:
@@ -466,7 +566,7 @@ class LessonHandler:
                     log.debug(f"Could not verify ViewState: {e}")
                 # -----------------------------
 
-                await asyncio.sleep(0.2)
+                await asyncio.sleep(0)  # yield only; endRequest fires after the panel is updated
                 return True
                 
             elif result == 'timeout':
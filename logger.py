@@ -1,16 +1,17 @@
+import atexit
+import functools
 import logging
 import os
+import queue
 from datetime import datetime
+from logging.handlers import MemoryHandler, QueueHandler, QueueListener
 
-def setup_logger(name: str) -> logging.Logger:
-    logger = logging.getLogger(name)
-    
-    # CRITICAL FIX: Return early if already configured
-    if logger.handlers:
-        return logger  # Already configured, don't add duplicate handlers
-    
-    logger.setLevel(logging.DEBUG)
-
+@functools.lru_cache(maxsize=None)
+def _get_queue_handler() -> QueueHandler:
+    """
+    Builds the process-wide handlers once: a single timestamped log file and the console,
+    both fed by one listener thread. Every named logger shares the returned QueueHandler.
+    """
     # Ensure logs directory exists with absolute path
     logs_dir = os.path.join(os.getcwd(), "logs")
     os.makedirs(logs_dir, exist_ok=True)
@@ -20,7 +21,6 @@ def setup_logger(name: str) -> logging.Logger:
     logfile = os.path.join(logs_dir, f"cdc_log_{timestamp}.log")
 
     try:
-        # Buffered file handler for better performance
         file_handler = logging.FileHandler(logfile, encoding="utf-8", mode='a', delay=False)
         file_handler.setLevel(logging.DEBUG)
         file_formatter = logging.Formatter(
@@ -28,6 +28,8 @@ def setup_logger(name: str) -> logging.Logger:
             datefmt='%Y-%m-%d %H:%M:%S'
         )
         file_handler.setFormatter(file_formatter)
+        # Buffered: debug/info lines are written in batches, warnings and above flush immediately
+        mem_handler = MemoryHandler(512, flushLevel=logging.WARNING, target=file_handler, flushOnClose=True)
     except PermissionError as e:
         raise RuntimeError(f"Failed to create log file '{logfile}'.") from e
 
@@ -39,8 +41,30 @@ def setup_logger(name: str) -> logging.Logger:
     )
     console_handler.setFormatter(console_formatter)
 
-    # Add both handlers
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    # The handlers' formatters and their writes run on a listener thread. The calling thread still
+    # merges the message args and renders tracebacks (QueueHandler.prepare) before enqueueing.
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, mem_handler, console_handler, respect_handler_level=True)
+    listener.start()
+
+    def stop_listener():
+        listener.stop()  # drains pending records
+        # Flush whatever the file buffer still holds
+        for handler in listener.handlers:
+            handler.close()
+
+    atexit.register(stop_listener)
+
+    return QueueHandler(log_queue)
+
+def setup_logger(name: str) -> logging.Logger:
+    logger = logging.getLogger(name)
+    
+    # CRITICAL FIX: Return early if already configured
+    if logger.handlers:
+        return logger  # Already configured, don't add duplicate handlers
+    
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(_get_queue_handler())
 
     return logger
\ No newline at end of file
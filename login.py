@@ -1,9 +1,48 @@
 import asyncio
-from utils.common import wait_for_elem, cloudflare_handler
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from utils.common import wait_for_elem, cloudflare_handler, wait_for_url
 from utils.logger import setup_logger
 
 log = setup_logger(__name__)
 
+PORTAL_HOST = "bookingportal.cdc.com.sg"
+
+async def _wait_for_enter():
+    """
+    Waits for the user to press ENTER without holding a thread from the default pool.
+    On POSIX the event loop watches stdin itself; otherwise (Windows, or stdin that
+    can't be polled) a dedicated single-thread executor does the blocking read.
+    """
+    loop = asyncio.get_running_loop()
+
+    if sys.platform != "win32":
+        fd = sys.stdin.fileno()
+        fut = loop.create_future()
+
+        def on_ready():
+            loop.remove_reader(fd)
+            sys.stdin.readline()
+            if not fut.done():
+                fut.set_result(None)
+
+        try:
+            loop.add_reader(fd, on_ready)
+        except (NotImplementedError, PermissionError, ValueError):
+            pass  # stdin isn't pollable here, fall back to the executor below
+        else:
+            try:
+                await fut
+            finally:
+                loop.remove_reader(fd)
+            return
+
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="login-input")
+    try:
+        await loop.run_in_executor(executor, input)
+    finally:
+        executor.shutdown(wait=False)
+
 class LoginManager:
     def __init__(self, tab, username, password, bot):
         self.tab = tab
@@ -38,25 +77,16 @@ class LoginManager:
         await pass_input.send_keys(self.password)
 
         log.warning("Please complete CAPTCHA manually.")
-        # input() is blocking, but in this context we might need to use asyncio.to_thread or just block if acceptable.
-        # Since this is a CLI tool, blocking input is fine for now, but strictly speaking it blocks the event loop.
-        # However, we are just waiting for user.
         print("Press ENTER after login is complete...")
-        await asyncio.to_thread(input)
+        await _wait_for_enter()
 
         log.debug("Submitting login form.")
         submit_btn = await self.tab.select(".btn-login-submit")
         await submit_btn.click()
 
-        try:
-            # Wait for URL to contain bookingportal
-            # nodriver doesn't have a direct "wait for url contains" but we can loop check
-            for _ in range(20): # 10 seconds (0.5 * 20)
-                # nodriver: evaluate location.href
-                current_url = await self.tab.evaluate("window.location.href")
-                if "bookingportal.cdc.com.sg" in current_url:
-                    return True
-                await asyncio.sleep(0.5)
-            return False
-        except Exception as e:
-            return False
\ No newline at end of file
+        return await self._wait_for_portal(timeout=10)
+
+    async def _wait_for_portal(self, timeout=10.0):
+        """Returns True once the post-login redirect reaches the booking portal."""
+        url = await wait_for_url(self.tab, PORTAL_HOST, timeout=timeout)
+        return bool(url) and PORTAL_HOST in url
\ No newline at end of file
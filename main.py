@@ -2,18 +2,26 @@ import json
 from website.driver import get_driver
 from website.login import LoginManager
 from website.lesson_handler import LessonHandler
-from website.booking_checker import filter_practical_slots, is_slot_confirmed, get_all_manual_bookings
+from website.booking_checker import Booking, filter_practical_slots, get_all_manual_bookings
 from utils.telegram import TelegramBot
-from utils.common import sleep_random, anonymize_fields, cloudflare_handler
+from utils.common import sleep_random, anonymize_fields, cloudflare_handler, suggested_backoff, empty_cycle_backoff, wait_for_event, evaluate_value
 from utils.logger import setup_logger  
 from utils.refreshmode import RefreshMode
 from datetime import datetime
 from dotenv import load_dotenv
 import os
+import re
 import time
 import yaml
 import asyncio
 
+# Per-session prices; a peak session is the most a single booking can cost
+NON_PEAK_COST = 73.03
+PEAK_COST = 81.75
+
+# Portal money amounts like "$123.45" or "$1,234.50"
+_VAL_RE = re.compile(r'\s*\$?\s*(\d[\d,]*(?:\.\d+)?)\s*$')
+
 def load_config():
     with open("config.yaml", "r") as f:
         return yaml.safe_load(f)
@@ -22,37 +30,72 @@ async def open_practical_safe(parser, driver, bot):
     await parser.open_practical_booking_page()
     await cloudflare_handler(driver, bot)
 
-def send_start_message(config, value, bot, all_manual_bookings=None):
-    formatted = datetime.now().strftime("%d/%b/%Y %H:%M:%S")
+# Constant expression, so the source text is the same every time it is evaluated
+_STORE_VALUE_JS = "document.getElementById('ctl00_HeaderSub_lblStoreValue')?.innerText.trim() ?? null"
+
+async def read_store_value(tab):
+    await tab.wait_for("#ctl00_HeaderSub_lblStoreValue", timeout=10)
+    return await evaluate_value(tab, _STORE_VALUE_JS)
+
+SESSION_TIMINGS = (
+    "📅 CDC Practical Session Timings:\n"
+    "  Session 1: 08:30 - 10:10 (Non-peak)\n"
+    "  Session 2: 10:20 - 12:00 (Peak)\n"
+    "  Session 3: 12:45 - 14:25 (Non-peak)\n"
+    "  Session 4: 14:35 - 16:15 (Non-peak)\n"
+    "  Session 5: 16:25 - 18:05 (Peak)\n"
+    "  Session 6: 18:50 - 20:30 (Peak)\n"
+    "  Session 7: 20:40 - 22:20 (Peak)"
+)
+
+def build_static_part(config):
+    """
+    Config-only part of the start message (allowed sessions, included and excluded dates).
+    The config doesn't change while the bot runs, so this is built once.
+    """
+    # Format allowed sessions
+    allowed_sessions = "".join(
+        f"  {day}: {', '.join(map(str, sessions))}\n"
+        for day, sessions in config.get("allowed_sessions", {}).items()
+    )
 
-    course_config = config['course']
+    allowed_dates = "".join(
+        f"  {date_str}: {', '.join(map(str, sessions))}\n"
+        for date_str, sessions in config.get("included_dates", {}).items()
+    )
 
-    # Format allowed sessions
-    allowed_sessions = ""
-    for day, sessions in config.get("allowed_sessions", {}).items():
-        allowed_sessions += f"  {day}: {', '.join(str(s) for s in sessions)}\n"
+    excluded_dates = "".join(
+        f"  {date_str}: {', '.join(map(str, sessions))}\n"
+        for date_str, sessions in config.get("excluded_dates", {}).items()
+    )
+
+    return (
+        f"Allowed Sessions:\n{allowed_sessions}\n"
+        f"Additional Included Dates:\n{allowed_dates}\n"
+        f"Excluded Dates:\n{excluded_dates}\n"
+    )
 
-    allowed_dates = ""
-    for date_str, sessions in config.get("included_dates", {}).items():
-        allowed_dates += f"  {date_str}: {', '.join(str(s) for s in sessions)}\n"
+def build_dynamic_part(config, value, all_manual_bookings=None):
+    """Per-call parts of the start message: timestamp, store value and current bookings."""
+    formatted = datetime.now().strftime("%d/%b/%Y %H:%M:%S")
 
-    excluded_dates = ""
-    for date_str, sessions in config.get("excluded_dates", {}).items():
-        excluded_dates += f"  {date_str}: {', '.join(str(s) for s in sessions)}\n"
+    course_config = config['course']
 
-    # Format booked sessions
-    booked_msg = f"Your booked {course_config['display_name']} sessions:\n"
+    # Format booked sessions; bookings arrive already in (date, session) order
     if all_manual_bookings:
-        for booking in sorted(all_manual_bookings, key=lambda x: (x["date"], x["session"])):
-            booked_msg += f"  - {booking['date'].strftime('%d/%b/%Y')} — Session {booking['session']}\n"
+        booked_lines = "".join(
+            f"  - {booking.date.strftime('%d/%b/%Y')} — Session {booking.session}\n"
+            for booking in all_manual_bookings
+        )
     else:
-        booked_msg += " None booked yet.\n"
+        booked_lines = " None booked yet.\n"
+    booked_msg = f"Your booked {course_config['display_name']} sessions:\n{booked_lines}"
 
     # Session cost estimation
-    non_peak = value // 73.03
-    peak = value // 81.75
+    non_peak = value // NON_PEAK_COST
+    peak = value // PEAK_COST
 
-    msg = (
+    header = (
         f"🤖 Bot started at {formatted}\n"
         f"AutoBook: {'Enabled' if config['auto_book'] else 'Disabled'}\n"
         f"Course: {course_config['display_name']}\n"
@@ -60,19 +103,15 @@ def send_start_message(config, value, bot, all_manual_bookings=None):
         f"Slots you can afford:\n"
         f"  - {non_peak:.0f} non-peak sessions\n"
         f"  - {peak:.0f} peak sessions\n\n"
-        f"Allowed Sessions:\n{allowed_sessions}\n"
-        f"Additional Included Dates:\n{allowed_dates}\n"
-        f"Excluded Dates:\n{excluded_dates}\n"
-        f"{booked_msg}\n"
-        "📅 CDC Practical Session Timings:\n"
-        "  Session 1: 08:30 - 10:10 (Non-peak)\n"
-        "  Session 2: 10:20 - 12:00 (Peak)\n"
-        "  Session 3: 12:45 - 14:25 (Non-peak)\n"
-        "  Session 4: 14:35 - 16:15 (Non-peak)\n"
-        "  Session 5: 16:25 - 18:05 (Peak)\n"
-        "  Session 6: 18:50 - 20:30 (Peak)\n"
-        "  Session 7: 20:40 - 22:20 (Peak)"
     )
+    return header, booked_msg
+
+def send_start_message(config, value, bot, all_manual_bookings=None, static_part=None):
+    if static_part is None:
+        static_part = build_static_part(config)
+
+    header, booked_msg = build_dynamic_part(config, value, all_manual_bookings)
+    msg = f"{header}{static_part}{booked_msg}\n{SESSION_TIMINGS}"
 
     bot.send(msg, False)
     return msg
@@ -84,6 +123,7 @@ async def main():
 
     config = load_config()
     course_config = config['course']
+    start_static_part = build_static_part(config)
     dry_run = config.get("dry_run", False)
     
     browser = await get_driver(headless=config["headless"])
@@ -98,7 +138,6 @@ async def main():
 
     log.info("Starting script after loading configuration and environment variables.")
     
-    cloudflare_count = 0
     backoff_multiplier = 1.0
 
     try:
@@ -111,62 +150,68 @@ async def main():
 
             await cloudflare_handler(tab, bot) # handle cloudflare
 
+            # One after the other: the scrape may navigate this tab to the dashboard again
+            # if the table isn't rendered yet, which would pull the page out from under the read
             all_manual_bookings = await get_all_manual_bookings(tab, course_config['name'], course_config['display_name'])
+            value_str = await read_store_value(tab)
 
             if all_manual_bookings:
                 log.debug(f"Found {len(all_manual_bookings)} previous {course_config['display_name']} bookings.")
             else:
                 log.error(f"No previous {course_config['display_name']} bookings found. Cannot compare slots.")
 
-            await tab.wait_for("#ctl00_HeaderSub_lblStoreValue", timeout=10)
-
-            js_extract = """
-            (() => {
-                const el = document.getElementById('ctl00_HeaderSub_lblStoreValue');
-                return el ? el.innerText.trim() : null;
-            })();
-            """
-            value_str = await tab.evaluate(js_extract)
-
             if value_check and value_str:
-                if isinstance(value_str, str):
-                    clean_val = value_str.replace('$', '').strip()
-                else:
+                if not isinstance(value_str, str):
                     log.error(f"Unexpected value type for store value: {type(value_str)}")
                     return
                 
-                try:
-                    current_val = float(clean_val)
-                    if current_val < 81.75:
-                        msg = f"Store value is too low (${current_val}). Min required: $81.75. Bot stopped."
-                        log.critical(msg)
-                        bot.send(f"[!] {msg}", False)
-                        return
-                    else:
-                        send_start_message(config, current_val, bot, all_manual_bookings)
-                except ValueError:
+                m = _VAL_RE.match(value_str)
+                current_val = float(m.group(1).replace(',', '')) if m else None
+                if current_val is None:
                     log.error(f"Could not parse store value: '{value_str}'")
+                elif current_val < PEAK_COST:
+                    msg = f"Store value is too low (${current_val}). Min required: ${PEAK_COST}. Bot stopped."
+                    log.critical(msg)
+                    bot.send(f"[!] {msg}", False)
+                    return
+                else:
+                    send_start_message(config, current_val, bot, all_manual_bookings, start_static_part)
 
             await open_practical_safe(parser, tab, bot)
 
             # await parser.select_course()
 
-            last_full_reload = time.time()
-            last_stats_log = time.time()
             cycle_counter = 0
-            ajax_failures = 0
             slot_found_counter = 0
+            consecutive_empty = 0
 
-            FULL_RELOAD_INTERVAL = 600
-            MAX_AJAX_FAILURES = 5
+            # Telegram commands arrive via a background long poll; the loop never waits on HTTP
+            commands = asyncio.Queue()
+            # Set by /stop the moment it arrives, so long waits end without finishing their timeout
+            stop_event = asyncio.Event()
+            bot.start_polling(commands, stop_event)
 
+            async def end_cycle(multiplier):
+                """Logs the cycle's duration, sleeps before the next poll and advances the counter."""
+                nonlocal cycle_counter
+                log.info("Cycle %d completed in %.2fms.", cycle_counter, (time.perf_counter() - cycle_start_time) * 1000)
+                await sleep_random(refresh_mode, multiplier, stop_event)
+                cycle_counter += 1
 
             while True:
                 cycle_start_time = time.perf_counter()
-                current_time = time.time()
+                backoff_multiplier = suggested_backoff()
+
+                # /stop jumps any commands queued ahead of it, so no further cycle (or booking) runs
+                if stop_event.is_set():
+                    cmd = "stop"
+                else:
+                    try:
+                        cmd = commands.get_nowait()
+                    except asyncio.QueueEmpty:
+                        cmd = None
 
-                # check_commands is sync, blocking but acceptable for now
-                cmd = bot.check_commands()
+                reply = None
                 if cmd == "stop":
                     await parser.open_logout()
                     log.info("Stopping bot after receiving /stop.")
@@ -175,7 +220,7 @@ async def main():
 
                 elif cmd == "status":
                     log.debug("Status command received.")
-                    bot.send(f"✅ Bot is running. Last check: {datetime.now().strftime('%d/%b/%Y %H:%M:%S')}", False)
+                    reply = f"✅ Bot is running. Last check: {datetime.now().strftime('%d/%b/%Y %H:%M:%S')}"
 
                 elif cmd == "screen":
                     await anonymize_fields(tab)
@@ -183,12 +228,11 @@ async def main():
                     bot.send_photo("logs/tele_screenshot.png", "📸 Current screen of the bot. Fields anonymized.", False)
                 
                 elif cmd == "stats":
-                    msg = (
+                    reply = (
                         f"📊 Bot Statistics:\n"
                         f"  - Slots found: {slot_found_counter}\n"
                         f"  - Cycles run: {cycle_counter}\n"
                     )
-                    bot.send(msg, False)
 
                 # success = await parser.trigger_postback_refresh()
 
@@ -198,7 +242,11 @@ async def main():
                 #     await cloudflare_handler(tab, bot)
                 #     await parser.select_course()
 
-                await tab.reload()
+                if reply:
+                    # The reply and the reload are independent round-trips, so overlap them
+                    await asyncio.gather(asyncio.to_thread(bot.send, reply, False), parser.reload())
+                else:
+                    await parser.reload()
                 await cloudflare_handler(tab, bot)
                 await parser.select_course()
 
@@ -207,6 +255,7 @@ async def main():
 
                 if all_slots:
                     slot_found_counter += 1
+                    consecutive_empty = 0
         
                     filtered = filter_practical_slots(all_slots, config, all_manual_bookings, bot)
 
@@ -221,18 +270,12 @@ async def main():
 
                     if not filtered:
                         log.info("No matching slots found.")
-                        cycle_end_time = time.perf_counter()
-                        elapsed = cycle_end_time - cycle_start_time
-                        log.info(f"Cycle {cycle_counter} completed in {elapsed * 1000:.2f}ms.")
-                        await sleep_random(refresh_mode, backoff_multiplier)
-                        cycle_counter += 1
+                        await end_cycle(backoff_multiplier)
                         continue
                 else:
-                    cycle_end_time = time.perf_counter()
-                    elapsed = cycle_end_time - cycle_start_time
-                    log.info(f"Cycle {cycle_counter} completed in {elapsed * 1000:.2f}ms.")
-                    await sleep_random(refresh_mode, backoff_multiplier)
-                    cycle_counter += 1
+                    consecutive_empty += 1
+                    # Back off further the longer the table stays empty
+                    await end_cycle(backoff_multiplier * empty_cycle_backoff(refresh_mode, consecutive_empty))
                     continue
                 
                 log.info(f"Found {len(filtered)} matching slots after filtering.")
@@ -266,6 +309,8 @@ async def main():
                                 else:
                                     log.info("Auto-confirm enabled, booking has been confirmed.")
                                     bot.send("Auto-confirm enabled, booking has been confirmed.", False)
+                                    # Count it as booked right away, without re-scraping the dashboard
+                                    all_manual_bookings.add(Booking.from_slot(slot))
 
                             booked_slots.append(slot)
 
@@ -282,38 +327,34 @@ async def main():
                     if booked_slots and not (dry_run or auto_book):
                         log.info(f"Waiting 3 minutes for user to confirm {len(booked_slots)} bookings...")
                         bot.send(f"You have booked {len(booked_slots)} slots. Please confirm them within 3 minutes.", False)
-                        await asyncio.sleep(180)
+                        if await wait_for_event(stop_event, 180):
+                            continue  # /stop is waiting in the command queue; handle it now
 
                         log.info("Checking if booked sessions are now confirmed...")
                         
+                        # One dashboard scrape covers every reserved slot
+                        updated = await get_all_manual_bookings(tab, course_config['name'], course_config['display_name'])
+                        confirmed_keys = {(b.date.strftime("%d/%b/%Y"), b.session) for b in updated}
+
                         for slot in booked_slots:
-                            confirmed = await is_slot_confirmed(tab, slot["date"], slot["session"], course_config['name'])
-                            if confirmed:
+                            if (slot["date"], slot["session"]) in confirmed_keys:
                                 msg = f"[✔] Booking confirmed: {slot['date']}, Session {slot['session']}, Day: {slot['dayname']}"
                                 log.info(msg)
                                 bot.send(msg, False)
                                 booked = True
-                                updated = await get_all_manual_bookings(tab, course_config['name'], course_config['display_name'])
-                                
-                                if updated:
-                                    all_manual_bookings = updated
-                                    log.debug(f"Updated {course_config['display_name']} bookings: {len(updated)} found.")
-                                    
-                                else:
-                                    log.error(f"Failed to update new {course_config['display_name']} bookings.")
                             else:
                                 msg = f"[X] Not confirmed: {slot['date']}, Session {slot['session']}, Day: {slot['dayname']} — please confirm manually and restart bot for updated bookings."
                                 log.info(msg)
                                 bot.send(msg, False)
 
+                        if booked:
+                            all_manual_bookings = updated
+                            log.debug(f"Updated {course_config['display_name']} bookings: {len(updated)} found.")
+
                         await open_practical_safe(parser, tab, bot)
                 if not booked:
                     log.warning("No slots booked this round. See logs for details.")
-                    cycle_end_time = time.perf_counter()
-                    elapsed = cycle_end_time - cycle_start_time
-                    log.info(f"Cycle {cycle_counter} completed in {elapsed * 1000:.2f}ms.")
-                    await sleep_random(refresh_mode, backoff_multiplier)
-                    cycle_counter += 1
+                    await end_cycle(backoff_multiplier)
         else:
             log.critical("Login failed. Please check your credentials or restart the bot to try again.")
     except Exception as e:
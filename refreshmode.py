@@ -2,6 +2,8 @@ import time
 import random
 
 class RefreshMode:
+    __slots__ = ('probe_mode', 'aggressive_cycles', 'probe_start', 'probe_duration', 'aggro_range')
+
     def __init__(self, probe_duration=10, aggro_range=(6, 8)):
         self.probe_mode = False
         self.aggressive_cycles = 0
@@ -23,19 +25,18 @@ class RefreshMode:
         if slots_found and not self.in_aggressive():
             if not self.probe_mode:
                 self.probe_mode = True
-                self.probe_start = time.time()
+                self.probe_start = time.monotonic()
                 return "probe"
 
         return "none"
 
     def tick(self):
-        if self.aggressive_cycles > 0:
+        if self.aggressive_cycles:
             self.aggressive_cycles -= 1
 
-        # Fix probe mode timeout logic
+        # Only read the clock while probing; monotonic so wall-clock adjustments can't end a probe early
         if self.probe_mode and self.probe_start is not None:
-            elapsed_time = time.time() - self.probe_start
-            if elapsed_time > self.probe_duration:
+            if time.monotonic() - self.probe_start > self.probe_duration:
                 self.probe_mode = False
                 self.probe_start = None
 
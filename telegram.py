@@ -1,19 +1,47 @@
+import asyncio
+import threading
+import time
+import orjson
 import requests
 from utils.logger import setup_logger
 
 log = setup_logger(__name__)
 
+# (connect, read) seconds for API calls, so a network stall fails the call instead of hanging the bot
+_HTTP_TIMEOUT = (5, 25)
+
+# Chat command -> name returned by check_commands
+_COMMANDS = {"/stop": "stop", "/status": "status", "/screen": "screen", "/stats": "stats"}
+
+class TelegramAPIError(Exception):
+    """An API call answered ok=false; `retry_after` carries Telegram's wait for 429 rate limits."""
+    def __init__(self, resp):
+        super().__init__(f"{resp.get('error_code')}: {resp.get('description')}")
+        self.retry_after = (resp.get("parameters") or {}).get("retry_after")
+
 class TelegramBot:
+    __slots__ = ('bot_token', 'chat_id', '_last_checked_update_id', '_session', '_poll_session',
+                 '_send_url', '_photo_url', '_updates_url')
+
     def __init__(self, bot_token, chat_id):
         self.bot_token = bot_token
         self.chat_id = chat_id
         self._last_checked_update_id = None
+        # One keep-alive connection pool for every API call, so the TLS handshake isn't repeated per request
+        self._session = requests.Session()
+        # Owned by the start_polling thread; requests.Session isn't safe to share across threads
+        self._poll_session = None
+
+        # API endpoints, built once
+        base = f"https://api.telegram.org/bot{bot_token}"
+        self._send_url = f"{base}/sendMessage"
+        self._photo_url = f"{base}/sendPhoto"
+        self._updates_url = f"{base}/getUpdates"
 
         self.clear_updates()
         self.init_last_update_id()
 
     def send(self, message, notifyOff=True):
-        url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
         data = {
             "chat_id": self.chat_id,
             "text": message,
@@ -21,15 +49,13 @@ class TelegramBot:
             "protect_content": True
         }
         try:
-            response = requests.post(url, data=data)
+            response = self._session.post(self._send_url, data=orjson.dumps(data), headers={"Content-Type": "application/json"}, timeout=_HTTP_TIMEOUT)
             return response.status_code == 200
         except Exception as e:
             print("[!] Telegram send failed:", e)
             return False
     
     def send_photo(self, photo_path, caption=None, notifyOff=True):
-        url = f"https://api.telegram.org/bot{self.bot_token}/sendPhoto"
-        files = {'photo': open(photo_path, 'rb')}
         data = {
             "chat_id": self.chat_id,
             "caption": caption,
@@ -37,46 +63,90 @@ class TelegramBot:
             "protect_content": True
         }
         try:
-            response = requests.post(url, files=files, data=data)
+            # Closed as soon as the upload finishes, instead of leaking a handle per screenshot
+            with open(photo_path, 'rb') as photo:
+                response = self._session.post(self._photo_url, files={'photo': photo}, data=data, timeout=_HTTP_TIMEOUT)
             return response.status_code == 200
         except Exception as e:
             print("[!] Telegram send photo failed:", e)
             return False
     
-    def check_commands(self):
+    def check_commands(self, timeout=0):
         try:
-            offset = (self._last_checked_update_id + 1) if self._last_checked_update_id is not None else 0
-            url = f"https://api.telegram.org/bot{self.bot_token}/getUpdates?offset={offset}"
-            resp = requests.get(url).json()
-
-            if "result" not in resp:
-                return None
+            return self._next_command(timeout)
+        except Exception as e:
+            print(f"[!] Error checking Telegram commands: {e}")
+        return None
 
-            for update in resp["result"]:
-                update_id = update["update_id"]
-                self._last_checked_update_id = update_id
+    def start_polling(self, commands, stop_event=None, timeout=25):
+        """
+        Long-polls getUpdates on a daemon thread and puts each command on the `commands`
+        asyncio.Queue, so the booking loop only needs a non-blocking get_nowait().
+        A /stop also sets `stop_event` (an asyncio.Event) so long waits can end early.
+        Must be called from the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        self._poll_session = requests.Session()
 
-                if str(update["message"]["chat"]["id"]) != self.chat_id:
+        def run():
+            while True:
+                try:
+                    cmd = self._next_command(timeout, self._poll_session)
+                except Exception as e:
+                    print(f"[!] Error checking Telegram commands: {e}")
+                    # Don't spin while the API is unreachable or refusing us; honour rate-limit waits
+                    time.sleep(getattr(e, "retry_after", None) or 5)
                     continue
+                if cmd:
+                    try:
+                        loop.call_soon_threadsafe(commands.put_nowait, cmd)
+                        if cmd == "stop" and stop_event is not None:
+                            loop.call_soon_threadsafe(stop_event.set)
+                    except RuntimeError:
+                        return  # event loop closed, the bot is shutting down
+
+        # Daemon, so a pending long poll never holds up interpreter exit
+        threading.Thread(target=run, name="telegram-poll", daemon=True).start()
+
+    def _next_command(self, timeout=0, session=None):
+        """
+        Returns the next command from getUpdates, or None. With `timeout` > 0 Telegram holds the
+        request open until an update arrives or `timeout` seconds pass (long polling).
+        `session` defaults to the shared one; the poll thread passes its own.
+        """
+        session = session or self._session
+        offset = (self._last_checked_update_id + 1) if self._last_checked_update_id is not None else 0
+        params = {"offset": offset, "timeout": timeout, "allowed_updates": '["message"]'}
+        resp = orjson.loads(session.get(self._updates_url, params=params, timeout=(_HTTP_TIMEOUT[0], timeout + 5)).content)
+        if not resp.get("ok"):
+            # e.g. 409 (another poller or a webhook) or 429; these come back immediately
+            raise TelegramAPIError(resp)
+
+        results = resp.get("result")
+        if not results:
+            return None
+
+        for update in results:
+            self._last_checked_update_id = update["update_id"]
+
+            msg = update.get("message")
+            if not msg or str(msg["chat"]["id"]) != self.chat_id:
+                continue
+
+            text = msg.get("text", "")
+            if not text.startswith("/"):
+                continue
+
+            # Return the first command; later updates are fetched again from the next offset
+            cmd = _COMMANDS.get(text.strip().lower())
+            if cmd:
+                return cmd
 
-                text = update["message"]["text"].strip().lower()
-                if text == "/stop":
-                    return "stop"
-                elif text == "/status":
-                    return "status"
-                elif text == "/screen":
-                    return "screen"
-                elif text == "/stats":
-                    return "stats"
-        
-        except Exception as e:
-            print(f"[!] Error checking Telegram commands: {e}")
         return None
     
     def init_last_update_id(self):
         try:
-            url = f"https://api.telegram.org/bot{self.bot_token}/getUpdates?limit=1"
-            resp = requests.get(url).json()
+            resp = orjson.loads(self._session.get(self._updates_url, params={"limit": 1}, timeout=_HTTP_TIMEOUT).content)
             if "result" in resp and resp["result"]:
                 self._last_checked_update_id = resp["result"][-1]["update_id"]
                 log.debug(f"[i] Initialized last update ID to {self._last_checked_update_id}")
@@ -85,13 +155,11 @@ class TelegramBot:
 
     def clear_updates(self):
         try:
-            url = f"https://api.telegram.org/bot{self.bot_token}/getUpdates"
-            resp = requests.get(url).json()
+            resp = orjson.loads(self._session.get(self._updates_url, timeout=_HTTP_TIMEOUT).content)
 
             if "result" in resp and resp["result"]:
                 last_update_id = resp["result"][-1]["update_id"]
-                clear_url = f"https://api.telegram.org/bot{self.bot_token}/getUpdates?offset={last_update_id + 1}"
-                requests.get(clear_url)
+                self._session.get(self._updates_url, params={"offset": last_update_id + 1}, timeout=_HTTP_TIMEOUT)
                 log.debug(f"[i] Cleared all pending updates up to {last_update_id}")
         except Exception as e:
             print(f"[!] Failed to clear Telegram updates: {e}")
\ No newline at end of file